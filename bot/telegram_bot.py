@@ -1,10 +1,11 @@
+import asyncio
 import base64
 import datetime
-import json
 import logging
 import mimetypes
 import os
 
+import orjson
 import requests
 from splitwise import SplitwiseError
 from telegram import Update, ReplyKeyboardRemove, WebAppInfo, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
@@ -25,6 +26,14 @@ logger = logging.getLogger(__name__)
 # Define conversation states
 SELECT_GROUP, CONFIRM, DUPLICATE_CHECK = range(3)
 
+# Marks OAuth2 state issued by the bot. Library-generated web states are alphanumeric,
+# so the dot keeps the two apart without trying to decode every state
+TELEGRAM_AUTH_STATE_PREFIX = 'tg.'
+
+# Directory for downloaded receipts, created once at import
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
 class TelegramBot:
     # Class variable to store the application instance
     _application = None
@@ -126,7 +135,7 @@ class TelegramBot:
         # Create a state parameter containing the user_id
         state_data = {"user_id": str(user_id)}
         # Base64 encode the state to avoid issues with quotes and special characters
-        state = base64.b64encode(json.dumps(state_data).encode('utf-8')).decode('utf-8')
+        state = TELEGRAM_AUTH_STATE_PREFIX + base64.urlsafe_b64encode(orjson.dumps(state_data)).decode('ascii')
 
         # Get the authorization URL from the Splitwise service
         sw = self._get_service(context)
@@ -156,7 +165,7 @@ class TelegramBot:
 
         # Get the list of groups
         sw = self._get_service(context)
-        groups = sw.get_groups()
+        groups = await asyncio.to_thread(sw.get_groups)
 
         if not groups:
             await update.message.reply_text(
@@ -203,13 +212,9 @@ class TelegramBot:
             # Get the selected group
             selected_group = groups[selection - 1]
 
-            # Store the selected group ID
+            # Store the selected group ID; services built by _get_service pick it up from here
             self.set_group_id(user_id, selected_group['id'], context)
 
-            # Set the group ID in the Splitwise service
-            sw = self._get_service(context)
-            sw.set_current_group_id(selected_group['id'])
-
             await update.message.reply_text(
                 f"You have selected the group: {selected_group['name']}\n\n"
                 "You can now start sending receipts.",
@@ -227,7 +232,7 @@ class TelegramBot:
     async def extract_file_info(self, update: Update) -> str:
         """Extract file information from the message."""
         user_id = update.effective_user.id
-        temp_file_path = None
+        file_path = None
 
         if update.message.photo:
             # Handle a photo: Get the largest photo (last in the array)
@@ -255,10 +260,8 @@ class TelegramBot:
 
         # Download the file to disk
         try:
-            uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-            os.makedirs(uploads_dir, exist_ok=True)
             file_name = f"{user_id}_receipt_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f')}{suffix}"
-            file_path = os.path.join(uploads_dir, file_name)
+            file_path = os.path.join(UPLOADS_DIR, file_name)
             await file_obj.download_to_drive(file_path)
             logger.info(f"Downloaded {original_filename} to {file_path}")
             return file_path
@@ -298,11 +301,7 @@ class TelegramBot:
                 return ConversationHandler.END
 
             # Check if the user has selected a group
-            if self.has_selected_group(user_id, context):
-                group_id = self.get_group_id(user_id, context)
-                sw = self._get_service(context)
-                sw.set_current_group_id(group_id)
-            else:
+            if not self.has_selected_group(user_id, context):
                 logger.info(f"User {user_id} has not selected a group")
                 await update.message.reply_text(
                     "You need to select a Splitwise group first. Please use the /change_group command."
@@ -310,6 +309,9 @@ class TelegramBot:
                 # Start the group selection conversation
                 return ConversationHandler.END
 
+            # One service per update so categories/users fetched for OCR are reused below
+            sw = self._get_service(context)
+
             await update.message.reply_text("Processing your receipt... Please wait.")
 
             try:
@@ -326,9 +328,10 @@ class TelegramBot:
                 user_text = ""
                 if update.message:
                     user_text = (update.message.caption or update.message.text or "").strip()
-                
-                sw = self._get_service(context)
-                receipt_info = receipt_processor.extract_receipt_info(
+
+                # Run the blocking OCR/LLM call off the event loop so the bot keeps serving other work
+                receipt_info = await asyncio.to_thread(
+                    receipt_processor.extract_receipt_info,
                     temp_file_path,
                     sw=sw,
                     user_text=user_text or None
@@ -345,16 +348,19 @@ class TelegramBot:
             # Prepare a serializable copy of receipt_info for the web app
             serializable_info = receipt_info.to_dict()
             
-            # Add group members and current user ID to web app data
+            # Add group members and current user ID to web app data, fetched off the event loop
+            users = []
             try:
-                sw = self._get_service(context)
-                serializable_info['group_members'] = [{'id': u['id'], 'name': u['name']} for u in sw.get_users()]
-                serializable_info['current_user_id'] = sw.get_current_user_id()
+                users, current_user_id = await asyncio.to_thread(
+                    lambda: (sw.get_users(), sw.get_current_user_id())
+                )
+                serializable_info['group_members'] = [{'id': u['id'], 'name': u['name']} for u in users]
+                serializable_info['current_user_id'] = current_user_id
             except Exception as e:
                 logger.error(f"Error fetching users for web app: {e}")
 
             try:
-                info_b64 = base64.urlsafe_b64encode(json.dumps(serializable_info, ensure_ascii=False).encode('utf-8')).decode('utf-8')
+                info_b64 = base64.urlsafe_b64encode(orjson.dumps(serializable_info)).decode('ascii')
             except Exception:
                 info_b64 = ''
             web_app_url = f"{config.WEB_APP_URL}/correct?data={info_b64}"
@@ -368,8 +374,7 @@ class TelegramBot:
             correction_reply_markup = ReplyKeyboardMarkup(correction_keyboard, resize_keyboard=True, one_time_keyboard=True)
 
             # Create summary
-            sw = self._get_service(context)
-            user_mapping = {u['id']: u['name'] for u in sw.get_users()}
+            user_mapping = {u['id']: u['name'] for u in users}
             summary = receipt_info.to_summary(user_mapping)
 
             await update.message.reply_text(
@@ -415,12 +420,12 @@ class TelegramBot:
         sw = self._get_service(context)
         # Check for potential duplicates unless force-proceeding
         if not force:
-            duplicates = sw.find_potential_duplicates(receipt_info)
+            duplicates = await asyncio.to_thread(sw.find_potential_duplicates, receipt_info)
             if duplicates:
                 dup_list = []
                 for d in duplicates:
                     # Format: Merchant: Amount Currency on Date (Category)
-                    date_str = d.date.strftime('%Y-%m-%d')
+                    date_str = d.date.date().isoformat()
                     dup_list.append(f"• *{d.merchant}*: {d.total} {d.currency_code} on {date_str} ({d.category})")
                 
                 dup_text = "\n".join(dup_list)
@@ -443,7 +448,7 @@ class TelegramBot:
                 return DUPLICATE_CHECK
 
         try:
-            result = sw.create_expense(receipt_info)
+            result = await asyncio.to_thread(sw.create_expense, receipt_info)
         except Exception as e:
             error_details = e.getErrors() if isinstance(e, SplitwiseError) else str(e)
             logger.error(f"Error creating expense: {error_details}")
@@ -464,7 +469,7 @@ class TelegramBot:
         attachment_note = ""
         if receipt_file_path:
             try:
-                sw.attach_receipt_to_expense(result['expense_id'], receipt_file_path)
+                await asyncio.to_thread(sw.attach_receipt_to_expense, result['expense_id'], receipt_file_path)
                 attachment_note = "\nReceipt image/PDF has been attached to the expense."
             except Exception as attach_err:
                 logger.error(f"Failed to attach receipt for expense {result['expense_id']}: {attach_err}")
@@ -543,7 +548,7 @@ class TelegramBot:
 
         # Parse incoming JSON
         try:
-            incoming = json.loads(message.web_app_data.data)
+            incoming = orjson.loads(message.web_app_data.data)
         except Exception as e:
             await message.reply_text(f"Failed to parse data from the app: {e}", reply_markup=ReplyKeyboardRemove())
             return ConversationHandler.END
@@ -658,23 +663,19 @@ class TelegramBot:
 
     async def check_pending_auth(self, context: ContextTypes.DEFAULT_TYPE):
         """Check for pending authentications and update user data."""
-        if hasattr(TelegramBot, '_pending_auth') and TelegramBot._pending_auth:
-            # Process each pending authentication
-            for user_id, access_token in list(TelegramBot._pending_auth.items()):
-                logger.info(f"Processing pending authentication for user {user_id}")
-                # Store the token in the user's context data
-                if user_id not in context.bot_data:
-                    context.bot_data[user_id] = {}
-                logger.info(f"Storing access token for user {user_id} in context.bot_data")
-                context.bot_data[user_id]['access_token'] = access_token
-
-                # Remove from pending list
-                logger.info(f"Removing access token for user {user_id} from `cls._pending_auth`")
-                del TelegramBot._pending_auth[user_id]
-
-                logger.info(f"Processed pending authentication for user {user_id}")
-        else:
-            logger.info("No pending authentications found")
+        pending_auth = getattr(TelegramBot, '_pending_auth', None)
+        if not pending_auth:
+            return
+
+        # Drain pending authentications; popitem removes each entry atomically
+        while pending_auth:
+            user_id, access_token = pending_auth.popitem()
+            logger.info(f"Processing pending authentication for user {user_id}")
+            # Store the token in the user's context data
+            logger.info(f"Storing access token for user {user_id} in context.bot_data")
+            context.bot_data.setdefault(user_id, {})['access_token'] = access_token
+
+            logger.info(f"Processed pending authentication for user {user_id}")
 
     async def _catch_all_confirm(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Catch-all handler for the CONFIRM state."""
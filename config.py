@@ -28,9 +28,15 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 WEB_APP_URL = os.getenv('WEB_APP_URL', 'http://localhost:5001')
 
 # Flask configuration
+# Stable key so signed session cookies survive restarts; a random one is generated when unset
+SECRET_KEY = os.getenv('FLASK_SECRET_KEY')
 UPLOAD_FOLDER = 'uploads'
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-TEMPLATES_AUTO_RELOAD = True
+TEMPLATES_AUTO_RELOAD = MODE == AppMode.dev  # templates are only edited during development
+
+# Splitwise categories persisted between runs, served while a fresh copy loads
+CATEGORIES_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'splitwise-integrator', 'categories.json')
+CATEGORIES_CACHE_MAX_AGE = 24 * 60 * 60  # seconds
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -1,13 +1,43 @@
 from __future__ import annotations
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Any, Dict, List, TYPE_CHECKING
+from typing import Optional, Any, Dict, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from splitwise.expense import Expense
 
 
-@dataclass
+# JSON schema for Structured Outputs; built once and shared, treat as read-only
+_RECEIPT_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "date": {"type": "string", "description": "ISO format date"},
+        "total": {"type": "string", "description": "Total amount as string"},
+        "merchant": {"type": "string"},
+        "currency_code": {"type": "string", "description": "3-letter currency code"},
+        "notes": {"type": "string", "description": "Specific details or description"},
+        "category": {"type": "string"},
+        "split_option": {"type": "string", "enum": ["equal", "exact"]},
+        "users": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "user_id": {"type": "integer"},
+                    "paid_share": {"type": "string", "description": "Amount this user paid"},
+                    "owed_share": {"type": "string", "description": "Amount this user owes"}
+                },
+                "required": ["user_id", "paid_share", "owed_share"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["date", "total", "merchant", "currency_code", "notes", "category", "split_option", "users"],
+    "additionalProperties": False
+}
+
+
+@dataclass(slots=True)
 class ReceiptInfo:
     date: datetime
     total: str
@@ -25,28 +55,32 @@ class ReceiptInfo:
     id: Optional[int] = None
 
     def to_dict(self) -> Dict[str, Any]:
-        d = asdict(self)
-        # ensure date serializable
-        if isinstance(self.date, datetime):
-            d['date'] = self.date.isoformat()
-        # ensure notes and category are strings for schema consistency
-        d['notes'] = self.notes or ""
-        d['category'] = self.category or ""
-        return d
+        # Built by hand rather than via asdict() to skip its generic recursive deep copy
+        return {
+            # ensure date serializable
+            'date': self.date.isoformat() if isinstance(self.date, datetime) else self.date,
+            'total': self.total,
+            'merchant': self.merchant,
+            'currency_code': self.currency_code,
+            # ensure notes and category are strings for schema consistency
+            'notes': self.notes or "",
+            'category': self.category or "",
+            'split_option': self.split_option,
+            'users': [dict(u) for u in self.users],
+            'payer_id': self.payer_id,
+            'share_type': self.share_type,
+            'share_value': self.share_value,
+            'id': self.id,
+        }
 
     def to_summary(self, user_mapping: Optional[Dict[int, str]] = None) -> str:
         """Returns a human-readable summary of the receipt information."""
-        date_str = self.date.strftime('%B %d, %Y')
-        if self.date.hour != 0 or self.date.minute != 0:
+        if self.date.hour or self.date.minute:
             date_str = self.date.strftime('%B %d, %Y, %H:%M')
+        else:
+            date_str = self.date.strftime('%B %d, %Y')
 
-        lines = [
-            f"Merchant: {self.merchant}",
-            f"Amount: {self.total} {self.currency_code}",
-            f"Date: {date_str}",
-            f"Category: {self.category or 'Not available'}"
-        ]
-
+        payer_line = ""
         if self.split_option == 'equal' and self.payer_id is None:
             split_summary = "Split equally"
         elif self.share_type or self.payer_id is not None:
@@ -55,7 +89,7 @@ class ReceiptInfo:
             if self.payer_id and user_mapping:
                 payer_name = user_mapping.get(self.payer_id, f"ID {self.payer_id}")
             
-            lines.append(f"Paid by: {payer_name}")
+            payer_line = f"- Paid by: {payer_name}\n"
             
             if self.share_type == 'equal':
                 split_summary = "Split equally"
@@ -81,40 +115,19 @@ class ReceiptInfo:
                     shares.append(f"{user_label} owes {owed}")
             split_summary = "Custom split: " + ", ".join(shares) if shares else "Custom split"
 
-        lines.append(f"Split: {split_summary}")
-        lines.append(f"Notes: {self.notes or 'None'}")
-        
-        return "\n".join(f"- {line}" for line in lines)
+        return (
+            f"- Merchant: {self.merchant}\n"
+            f"- Amount: {self.total} {self.currency_code}\n"
+            f"- Date: {date_str}\n"
+            f"- Category: {self.category or 'Not available'}\n"
+            f"{payer_line}"
+            f"- Split: {split_summary}\n"
+            f"- Notes: {self.notes or 'None'}"
+        )
 
     @staticmethod
     def get_json_schema() -> Dict[str, Any]:
-        return {
-            "type": "object",
-            "properties": {
-                "date": {"type": "string", "description": "ISO format date"},
-                "total": {"type": "string", "description": "Total amount as string"},
-                "merchant": {"type": "string"},
-                "currency_code": {"type": "string", "description": "3-letter currency code"},
-                "notes": {"type": "string", "description": "Specific details or description"},
-                "category": {"type": "string"},
-                "split_option": {"type": "string", "enum": ["equal", "exact"]},
-                "users": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "user_id": {"type": "integer"},
-                            "paid_share": {"type": "string", "description": "Amount this user paid"},
-                            "owed_share": {"type": "string", "description": "Amount this user owes"}
-                        },
-                        "required": ["user_id", "paid_share", "owed_share"],
-                        "additionalProperties": False
-                    }
-                }
-            },
-            "required": ["date", "total", "merchant", "currency_code", "notes", "category", "split_option", "users"],
-            "additionalProperties": False
-        }
+        return _RECEIPT_JSON_SCHEMA
 
     @staticmethod
     def _coerce_date(value: Any) -> datetime:
@@ -122,16 +135,24 @@ class ReceiptInfo:
             return value
         if isinstance(value, str) and value:
             try:
-                # try YYYY-MM-DD first
-                return datetime.strptime(value, "%Y-%m-%d")
-            except Exception:
+                # handles both YYYY-MM-DD and full ISO timestamps without raising
+                return datetime.fromisoformat(value)
+            except ValueError:
                 try:
-                    return datetime.fromisoformat(value)
-                except Exception:
+                    # lenient fallback, e.g. non-padded YYYY-M-D
+                    return datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
                     pass
         # fallback to now
         return datetime.now()
 
+    @staticmethod
+    def _coerce_total(value: Any) -> str:
+        try:
+            return str(float(value))
+        except Exception:
+            return str(value)
+
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "ReceiptInfo":
         # Normalize and coerce types
@@ -141,11 +162,7 @@ class ReceiptInfo:
         if isinstance(currency_code, str):
             currency_code = currency_code.upper()
 
-        total_raw = data.get('total', '0')
-        try:
-            total = str(float(total_raw))
-        except Exception:
-            total = str(total_raw)
+        total = cls._coerce_total(data.get('total', '0'))
 
         merchant = data.get('merchant') or 'Unknown'
         notes = data.get('notes')
@@ -182,26 +199,26 @@ class ReceiptInfo:
         )
 
     @classmethod
-    def from_expense(cls, e: Expense, categories: Optional[List[Dict[str, Any]]] = None) -> ReceiptInfo:
-        """Unified converter from Splitwise Expense to ReceiptInfo"""
+    def from_expense(cls, e: Expense, category_names: Optional[Dict[str, str]] = None) -> ReceiptInfo:
+        """Unified converter from Splitwise Expense to ReceiptInfo.
+        category_names maps str(category id) to the full category name used in this app."""
         category_obj = e.getCategory()
         category_name = category_obj.getName()
-        if categories:
-            category_name = next(
-                (c['name'] for c in categories if str(c['id']) == str(category_obj.getId())),
-                category_name
-            )
+        if category_names:
+            category_name = category_names.get(str(category_obj.getId()), category_name)
 
         # Split details logic
         is_split_equally = True
         sw_users = e.getUsers()
         users_shares = []
         if sw_users:
+            # Compare in integer cents: an equal split gives everyone the base share,
+            # with the leftover cents of the remainder spread one per user
             try:
-                cost = float(e.getCost())
-                equal_split = cost / len(sw_users)
-            except (ValueError, TypeError, ZeroDivisionError):
-                equal_split = 0
+                cost_cents = round(float(e.getCost()) * 100)
+            except (ValueError, TypeError):
+                cost_cents = 0
+            equal_split_cents = cost_cents // len(sw_users)
 
             for u in sw_users:
                 paid_share = float(u.getPaidShare() or 0)
@@ -211,7 +228,8 @@ class ReceiptInfo:
                     "paid_share": paid_share,
                     "owed_share": owed_share
                 })
-                if abs(owed_share - equal_split) > 0.01:
+                # Shares are still collected once the answer is known, only the check is skipped
+                if is_split_equally and not equal_split_cents <= round(owed_share * 100) <= equal_split_cents + 1:
                     is_split_equally = False
 
         split_option = "equal" if is_split_equally else "exact"
@@ -229,16 +247,30 @@ class ReceiptInfo:
         )
 
     def update_from_dict(self, data: Dict[str, Any]) -> None:
-        updated = ReceiptInfo.from_dict({**self.to_dict(), **data})
-        self.date = updated.date
-        self.total = updated.total
-        self.merchant = updated.merchant
-        self.currency_code = updated.currency_code
-        self.notes = updated.notes
-        self.category = updated.category
-        self.split_option = updated.split_option
-        self.users = updated.users
-        self.payer_id = updated.payer_id
-        self.share_type = updated.share_type
-        self.share_value = updated.share_value
-        self.id = updated.id
+        """Apply the fields present in data in place, normalized the same way as from_dict"""
+        if 'date' in data:
+            self.date = self._coerce_date(data['date'])
+        if 'currency_code' in data:
+            currency_code = data['currency_code'] or data.get('currencyCode') or 'EUR'
+            self.currency_code = currency_code.upper() if isinstance(currency_code, str) else currency_code
+        if 'total' in data:
+            self.total = self._coerce_total(data['total'])
+        if 'merchant' in data:
+            self.merchant = data['merchant'] or 'Unknown'
+        if 'notes' in data:
+            self.notes = data['notes']
+        if 'category' in data:
+            self.category = data['category']
+        if 'split_option' in data:
+            # Fallback for legacy split_equally field
+            self.split_option = data['split_option'] or ('equal' if data.get('split_equally', True) else 'exact')
+        if 'users' in data:
+            self.users = data['users']
+        if 'payer_id' in data:
+            self.payer_id = int(data['payer_id']) if data['payer_id'] is not None else None
+        if 'share_type' in data:
+            self.share_type = data['share_type']
+        if 'share_value' in data:
+            self.share_value = data['share_value']
+        if 'id' in data:
+            self.id = int(data['id']) if data['id'] is not None else None
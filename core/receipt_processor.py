@@ -4,9 +4,10 @@ import mimetypes
 import logging
 import base64
 import io
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 import dateutil
+import orjson
 from PIL import Image
 import PyPDF2
 import pillow_heif
@@ -15,41 +16,72 @@ import config
 from core.splitwise_service import SplitwiseService
 from core.receipt_info import ReceiptInfo
 
+# Expected JSON schema for Structured Outputs; invariant, so built once
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "receipt_info",
+        "strict": True,
+        "schema": ReceiptInfo.get_json_schema()
+    }
+}
+
+# Image formats accepted by the vision model as-is, by file extension
+PASSTHROUGH_IMAGE_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+# Common prompt; only the placeholders vary between receipts
+PROMPT_TEMPLATE = (
+    "Extract information from this receipt and determine the Splitwise expense details.\n\n"
+    "GROUP MEMBERS:\n{users_list}\n\n"
+    "CONSISTENCY RULES:\n"
+    "1. Merchant Name: Use the chain name (e.g., 'Jumbo', 'Albert Heijn') if applicable.\n"
+    "2. Category: Select from: {categories}\n"
+    "3. Split Behavior: Follow patterns from examples if provided. Determine who paid and how it should be split among the group members listed above.\n"
+    "{examples}"
+    "\nToday is {today}.\n"
+)
+
 class ReceiptProcessor:
     def __init__(self):
         self.openai_client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
 
     def extract_receipt_info(self, file_path, sw: SplitwiseService, user_text: str | None = None) -> ReceiptInfo:
         """Extract information from receipt using OpenAI's vision model"""
-        categories = sw.get_categories()
-        categories_str = ", ".join(cat['name'] for cat in categories)
-        
-        # Get group members
-        users = sw.get_users()
-        users_list_str = "\n".join([f"- {u['name']} (ID: {u['id']})" for u in users])
-        
-        # Get representative examples from past transactions
-        examples = sw.get_representative_examples()
-        examples_str = ""
-        if examples:
-            formatted_examples = [ex.to_dict() for ex in examples]
-            examples_str = "\nEXAMPLES OF PAST TRANSACTIONS (use these for consistency):\n"
-            examples_str += json.dumps(formatted_examples, indent=2, ensure_ascii=False) + "\n"
-
         # Determine file type
         mime_type, _ = mimetypes.guess_type(file_path)
         is_pdf = mime_type == 'application/pdf'
 
+        # The Splitwise lookups are independent HTTP round trips; overlap them with each other and the file encoding
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            categories_future = executor.submit(sw.get_categories_joined)
+            users_future = executor.submit(sw.get_users)
+            examples_future = executor.submit(sw.get_representative_examples_json)
+            file_future = executor.submit(self._handle_pdf if is_pdf else self._handle_image, file_path)
+
+            categories_str = categories_future.result()
+
+            # Get group members
+            users_list_str = "\n".join([f"- {u['name']} (ID: {u['id']})" for u in users_future.result()])
+
+            # Get representative examples from past transactions
+            examples_json = examples_future.result()
+            file_item = file_future.result()
+
+        examples_str = ""
+        if examples_json:
+            examples_str = "\nEXAMPLES OF PAST TRANSACTIONS (use these for consistency):\n" + examples_json + "\n"
+
         # Common prompt
-        initial_prompt = (
-            "Extract information from this receipt and determine the Splitwise expense details.\n\n"
-            "GROUP MEMBERS:\n" + users_list_str + "\n\n"
-            "CONSISTENCY RULES:\n"
-            "1. Merchant Name: Use the chain name (e.g., 'Jumbo', 'Albert Heijn') if applicable.\n"
-            "2. Category: Select from: " + categories_str + "\n"
-            "3. Split Behavior: Follow patterns from examples if provided. Determine who paid and how it should be split among the group members listed above.\n"
-            + examples_str +
-            "\nToday is " + datetime.datetime.now().strftime('%Y-%m-%d') + ".\n"
+        initial_prompt = PROMPT_TEMPLATE.format(
+            users_list=users_list_str,
+            categories=categories_str,
+            examples=examples_str,
+            today=datetime.date.today().isoformat()
         )
 
         content_items = [{"type": "text", "text": initial_prompt}]
@@ -58,30 +90,17 @@ class ReceiptProcessor:
                 "type": "text",
                 "text": f"USER NOTES FROM MESSAGE:\n{user_text}\n"
             })
-        if is_pdf:
-            content_items.append(self._handle_pdf(file_path))
-        else:
-            content_items.append(self._handle_image(file_path))
-
-        # Define the expected JSON schema for Structured Outputs
-        response_format = {
-            "type": "json_schema",
-            "json_schema": {
-                "name": "receipt_info",
-                "strict": True,
-                "schema": ReceiptInfo.get_json_schema()
-            }
-        }
+        content_items.append(file_item)
 
         # Call OpenAI API
         response = self.openai_client.chat.completions.create(
             model="gpt-4o",
             messages=[{"role": "user", "content": content_items}],
-            response_format=response_format,
+            response_format=RESPONSE_FORMAT,
             max_tokens=500
         )
 
-        result = json.loads(response.choices[0].message.content)
+        result = orjson.loads(response.choices[0].message.content)
         try:
             return ReceiptInfo.from_dict(result)
         except Exception as e:
@@ -90,6 +109,18 @@ class ReceiptProcessor:
     def _handle_image(self, file_path):
         """Process image files (including HEIC/HEIF)"""
         file_lower = file_path.lower()
+        mime_type = PASSTHROUGH_IMAGE_TYPES.get(os.path.splitext(file_lower)[1])
+        if mime_type:
+            # Formats the model accepts natively are sent as-is, without a PNG re-encode
+            with open(file_path, 'rb') as file:
+                img_str = base64.b64encode(file.read()).decode('ascii')
+            return {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{img_str}"
+                }
+            }
+
         if file_lower.endswith('.heic') or file_lower.endswith('.heif'):
             try:
                 heif_file = pillow_heif.read_heif(file_path)
@@ -109,7 +140,7 @@ class ReceiptProcessor:
         try:
             buffered = io.BytesIO()
             img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            img_str = base64.b64encode(buffered.getvalue()).decode('ascii')
 
             return {
                 "type": "image_url",
@@ -124,21 +155,19 @@ class ReceiptProcessor:
         """Process PDF files"""
         with open(file_path, 'rb') as file:
             # Encode the PDF file as base64
-            file.seek(0)
-            pdf_bytes = file.read()
-            pdf_base64 = base64.b64encode(pdf_bytes).decode()
+            pdf_base64 = base64.b64encode(file.read())
 
-            # Add the data URL prefix required by OpenAI API
-            pdf_data_url = f"data:application/pdf;base64,{pdf_base64}"
+        # Add the data URL prefix required by OpenAI API, decoding to str once
+        pdf_data_url = (b"data:application/pdf;base64," + pdf_base64).decode('ascii')
 
-            # Add the PDF file to the content items
-            return {
-                "type": "file",
-                "file": {
-                    "filename": os.path.basename(file_path),
-                    "file_data": pdf_data_url
-                }
+        # Add the PDF file to the content items
+        return {
+            "type": "file",
+            "file": {
+                "filename": os.path.basename(file_path),
+                "file_data": pdf_data_url
             }
+        }
 
 # Create a singleton instance
 receipt_processor = ReceiptProcessor()
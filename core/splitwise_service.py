@@ -1,15 +1,172 @@
+import hashlib
+import http.cookiejar
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import splitwise
 from dateutil.relativedelta import relativedelta
+from splitwise.category import Category
 from splitwise.expense import Expense
 from splitwise.user import ExpenseUser
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from datetime import date, datetime
 import config
 from core.receipt_info import ReceiptInfo
 
+
+class _TTLCache:
+    """Small thread-safe mapping whose entries expire ttl seconds after being set"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired entries so the cache does not grow with every user seen
+            for stale_key in [k for k, (ts, _) in self._data.items() if now - ts >= self.ttl]:
+                del self._data[stale_key]
+            self._data[key] = (now, value)
+
+
+# Caches shared across service instances, which are created per request:
+# categories, their serialized form, groups and the current user by token digest,
+# users and serialized examples by (token digest, group id)
+_categories_cache = _TTLCache(ttl=3600)
+_categories_json_cache = _TTLCache(ttl=3600)
+_groups_cache = _TTLCache(ttl=120)
+_current_user_cache = _TTLCache(ttl=3600)
+_users_cache = _TTLCache(ttl=600)
+_examples_cache = _TTLCache(ttl=300)
+
+# Runs independent Splitwise lookups in the background so their round trips overlap
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='splitwise-prefetch')
+
+# Pooled keep-alive connections for all Splitwise API calls, so repeated calls skip the TLS handshake.
+# Only idempotent methods are retried (urllib3 default), so receipt uploads are never sent twice.
+# Once retries run out the last response is returned (raise_on_status=False), so the SDK still maps it to its exceptions.
+_http_session = requests.Session()
+_http_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503], raise_on_status=False)
+))
+# The session is shared by every user's calls; accept no cookies, so none set for one user are sent with another's
+_http_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+# (connect, read) seconds for calls on the pooled session, so a stalled connection cannot hang a worker
+_HTTP_TIMEOUT = (5, 30)
+
+# Held while a background refresh of the persisted categories is running
+_categories_refresh_lock = threading.Lock()
+
+def _load_categories_file():
+    """Categories persisted by a previous run with their age in seconds, or (None, None)"""
+    path = config.CATEGORIES_CACHE_FILE
+    try:
+        age = time.time() - os.path.getmtime(path)
+        if age > config.CATEGORIES_CACHE_MAX_AGE:
+            return None, None
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read()), age
+    except (OSError, orjson.JSONDecodeError):
+        return None, None
+
+def _save_categories_file(categories):
+    """Persist categories for the next process start, replacing the file atomically"""
+    path = config.CATEGORIES_CACHE_FILE
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(categories))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not persist Splitwise categories: {e}")
+
+# Words of a category name, e.g. 'food', 'and', 'drink', 'groceries' for 'Food and drink / Groceries'
+_CATEGORY_TOKEN_RE = re.compile(r'[^\s/]+')
+# Words shared by many unrelated categories, which say nothing about which one is meant
+_CATEGORY_STOPWORDS = frozenset({'and', '&', 'other'})
+# Share of a query's words a category must contain to be picked by the word index
+_CATEGORY_MIN_WORD_SHARE = 0.5
+
+def _category_words(lower_name):
+    """Distinctive words of a lowercased category name or query"""
+    return set(_CATEGORY_TOKEN_RE.findall(lower_name)) - _CATEGORY_STOPWORDS
+
+def _token_digest(access_token):
+    """Stable cache key for an OAuth2 token dict, so caches never hold the bearer token itself"""
+    if not access_token:
+        return None
+    return hashlib.blake2b(access_token['access_token'].encode(), digest_size=16).digest()
+
+def _safe_float(value, default=float('nan')):
+    """Convert to float, returning default for missing or malformed values"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+def _parse_day(value):
+    """Calendar day from a Splitwise ISO timestamp such as '2024-01-31T12:00:00Z', or None"""
+    try:
+        return date.fromisoformat(value[:10])
+    except (ValueError, TypeError):
+        return None
+
+def _owed_share_for_amount(total, share_value):
+    """Current user's owed share when given as an amount"""
+    return float(share_value)
+
+def _owed_share_for_percentage(total, share_value):
+    """Current user's owed share when given as a percentage of the total"""
+    return (float(share_value) / 100.0) * total
+
+# Current user's owed share by share_type; 'equal' and unknown types keep the equal split
+_OWED_SHARE_HANDLERS = {
+    'amount': _owed_share_for_amount,
+    'percentage': _owed_share_for_percentage,
+}
+
+
+class _PooledSplitwise(splitwise.Splitwise):
+    """Splitwise client that sends its API calls through the shared keep-alive session;
+    the SDK opens a new requests session, and so a new TLS connection, for every call"""
+
+    def _Splitwise__makeRequest(self, url, method="GET", data=None, auth=None, files=None):
+        # Same as the SDK's private __makeRequest apart from the session used
+        headers = {}
+        if auth is None:
+            if self.auth:
+                auth = self.auth
+            elif self.api_key:
+                headers = {'Authorization': f'Bearer {self.api_key}'}
+
+        data = splitwise.Splitwise._Splitwise__handleUppercaseBoolean(data)
+        prep_req = requests.Request(method=method, url=url, headers=headers, data=data, auth=auth, files=files).prepare()
+        response = _http_session.send(prep_req, timeout=_HTTP_TIMEOUT)
+        return self._Splitwise__handleResponse(response)
+
+
 class SplitwiseService:
     def __init__(self, access_token=None, group_id=None):
-        self.client = splitwise.Splitwise(
+        self.client = _PooledSplitwise(
             config.SPLITWISE_CONSUMER_KEY,
             config.SPLITWISE_CONSUMER_SECRET
         )
@@ -19,27 +176,53 @@ class SplitwiseService:
         
         self.current_group_id = group_id or config.SPLITWISE_GROUP_ID
         self.categories = []
+        self._category_by_name = {}
+        self._category_by_lower_name = {}
+        self._category_by_subname = {}
+        self._category_positions_by_token = {}
+        self._category_names = []
+        self._category_name_by_id = {}
+        self._categories_joined = ""
         self.users = []
+        # Guard lazy loading, since lookups may run from several threads at once
+        self._categories_lock = threading.Lock()
+        self._users_lock = threading.Lock()
+        self._current_user = None
         self._current_user_id = None
+        self._examples_json = None
+
+    def _cache_key(self):
+        """Key for process-wide caches: the access token digest and the current group"""
+        return _token_digest(self.access_token), str(self.current_group_id)
 
     def get_current_user_id(self):
         """Get the current user ID, cached"""
         if self._current_user_id is None:
-            self._current_user_id = self.client.getCurrentUser().getId()
+            self.get_current_user()
         return self._current_user_id
 
     def set_oauth2_token(self, access_token):
         """Set the OAuth2 token in the Splitwise client"""
+        if access_token and access_token == self.access_token:
+            # Same token, keep the cached current user
+            return True
         self.access_token = access_token
         self.client.setOAuth2AccessToken(access_token)
-        self._current_user_id = None  # Reset cached user ID
+        # Reset the cached user and start fetching the one for the new token
+        self._current_user = None
+        self._current_user_id = None
+        _prefetch_pool.submit(self._warm_current_user)
         return True
 
     def set_current_group_id(self, group_id):
         """Set the current group ID"""
+        if self.current_group_id is not None and str(self.current_group_id) == str(group_id):
+            # Same group, keep the cached users
+            return True
         self.current_group_id = group_id
-        # Clear the users list to force reloading with the new group
+        # Clear the group-specific caches to force reloading with the new group
         self.users = []
+        self._examples_json = None
         return True
 
     def get_oauth2_authorize_url(self, redirect_uri, state=None):
@@ -51,59 +234,187 @@ class SplitwiseService:
         return self.client.getOAuth2AccessToken(code, redirect_uri)
 
     def get_current_user(self):
-        """Get the current user"""
-        return self.client.getCurrentUser()
+        """Get the current user, cached per access token"""
+        if self._current_user is None:
+            token = self._cache_key()[0]
+            user = _current_user_cache.get(token)
+            if user is None:
+                user = self.client.getCurrentUser()
+                _current_user_cache.set(token, user)
+            self._current_user_id = user.getId()
+            self._current_user = user
+        return self._current_user
+
+    def _warm_current_user(self):
+        """Fetch the current user ahead of the first expense, so creating it skips the round trip"""
+        try:
+            self.get_current_user()
+        except Exception as e:
+            logging.warning(f"Prefetching the current Splitwise user failed: {e}")
 
     def init_categories(self):
         """Initialize categories from Splitwise"""
-        self.categories = []
+        categories = []
         for category in self.client.getCategories():
-            self.categories.append({'id': category.getId(), 'name': category.getName(), 'object': category})
+            # Keep only id and name; SDK objects are rebuilt on demand by _materialize_category
+            categories.append({'id': category.getId(), 'name': category.getName()})
             for subcat in category.getSubcategories():
-                self.categories.append({'id': subcat.getId(), 'name': f'{category.getName()} / {subcat.getName()}', 'object': subcat})
+                categories.append({'id': subcat.getId(), 'name': f'{category.getName()} / {subcat.getName()}'})
+        _categories_cache.set(self._cache_key()[0], categories)
+        _save_categories_file(categories)
+        return self._set_categories(categories)
+
+    def _set_categories(self, categories):
+        """Build the lookup indexes for categories and publish them on the instance"""
+        # Name indexes for get_category_by_name; the first category wins on clashes
+        by_name = {}
+        by_lower_name = {}
+        by_subname = {}
+        positions_by_token = {}
+        for position, cat in enumerate(categories):
+            by_name.setdefault(cat['name'], cat)
+            lower_name = cat['name'].lower()
+            by_lower_name.setdefault(lower_name, cat)
+            # Last path segment, e.g. 'groceries' for 'Food and drink / Groceries'
+            by_subname.setdefault(lower_name.rpartition(' / ')[2], cat)
+            for token in _category_words(lower_name):
+                positions_by_token.setdefault(token, []).append(position)
+        self._category_by_name = by_name
+        self._category_by_lower_name = by_lower_name
+        self._category_by_subname = by_subname
+        self._category_positions_by_token = positions_by_token
+        # Names as a flat list parallel to categories, so scans touch only the strings
+        names = [cat['name'] for cat in categories]
+        self._category_names = names
+        # Full names keyed by str(id), for converting expenses
+        self._category_name_by_id = {str(cat['id']): name for cat, name in zip(categories, names)}
+        # Prompt-ready list of names, joined once
+        self._categories_joined = ", ".join(names)
+        # Publish the list last so concurrent readers never see it half-filled
+        self.categories = categories
         return self.categories
 
     def get_categories(self):
         """Get all categories"""
         if not self.categories:
-            self.init_categories()
+            with self._categories_lock:
+                if not self.categories:
+                    cached = _categories_cache.get(self._cache_key()[0])
+                    if not cached:
+                        cached = self._load_persisted_categories()
+                    if cached:
+                        self._set_categories(cached)
+                    else:
+                        self.init_categories()
         return self.categories
 
+    def _load_persisted_categories(self):
+        """Serve categories saved by a previous run, refreshing them in the background when stale"""
+        categories, age = _load_categories_file()
+        if not categories:
+            return None
+        _categories_cache.set(self._cache_key()[0], categories)
+        if age > _categories_cache.ttl and _categories_refresh_lock.acquire(blocking=False):
+            def refresh():
+                try:
+                    self.init_categories()
+                except Exception as e:
+                    logging.warning(f"Background refresh of Splitwise categories failed: {e}")
+                finally:
+                    _categories_refresh_lock.release()
+            _prefetch_pool.submit(refresh)
+        return categories
+
+    def _prefetch_categories(self):
+        """Start loading categories in the background unless already loaded"""
+        if not self.categories:
+            _prefetch_pool.submit(self.get_categories)
+
+    def get_categories_joined(self):
+        """Get all category names as a single comma-separated string"""
+        self.get_categories()
+        return self._categories_joined
+
+    def get_categories_json(self):
+        """Get categories sorted by name and serialized as JSON bytes for the web client, cached"""
+        key = self._cache_key()[0]
+        categories_json = _categories_json_cache.get(key)
+        if categories_json is None:
+            # Entries only hold id and name, so they serialize as they are
+            categories_json = orjson.dumps(sorted(self.get_categories(), key=lambda c: c['name'].lower()))
+            _categories_json_cache.set(key, categories_json)
+        return categories_json
+
     def get_category_by_name(self, category_name):
         """Get a category by name"""
-        if not self.categories:
-            self.init_categories()
-        for cat in self.categories:
-            if category_name in cat['name']:
-                return cat['object']
+        self.get_categories()
+        lower_name = category_name.lower()
+        category = (
+            self._category_by_name.get(category_name)
+            or self._category_by_lower_name.get(lower_name)
+            or self._category_by_subname.get(lower_name)
+        )
+        if category is not None:
+            return self._materialize_category(category)
+        # Score categories by the share of the query's words they contain; earlier categories win ties
+        query_words = _category_words(lower_name)
+        scores = {}
+        for token in query_words:
+            for position in self._category_positions_by_token.get(token, ()):
+                scores[position] = scores.get(position, 0) + 1
+        if scores:
+            best = max(scores, key=lambda position: (scores[position], -position))
+            if scores[best] / len(query_words) >= _CATEGORY_MIN_WORD_SHARE:
+                return self._materialize_category(self.categories[best])
+        # Fall back to a substring match
+        for position, name in enumerate(self._category_names):
+            if category_name in name:
+                return self._materialize_category(self.categories[position])
         return None
 
+    @staticmethod
+    def _materialize_category(cat):
+        """Build the SDK Category object for an entry of the categories list"""
+        return Category({'id': cat['id'], 'name': cat['name']})
+
     def init_users(self):
         """Initialize users from the specified group"""
-        self.users = []
+        users = []
         group = self.client.getGroup(int(self.current_group_id))
         for splitwise_user in group.members:
-            user = ExpenseUser()
-            user.setId(splitwise_user.getId())
-            self.users.append({
+            users.append({
                 'id': splitwise_user.getId(), 
-                'name': splitwise_user.getFirstName() + ' ' + splitwise_user.getLastName(), 
-                'object': user
+                'name': splitwise_user.getFirstName() + ' ' + splitwise_user.getLastName()
             })
+        _users_cache.set(self._cache_key(), users)
+        self.users = users
         return self.users
 
     def get_users(self):
         """Get all users in the group"""
         if not self.users:
-            self.init_users()
+            with self._users_lock:
+                if not self.users:
+                    self.users = _users_cache.get(self._cache_key()) or self.init_users()
         return self.users
 
+    def _prefetch_users(self):
+        """Start loading group users in the background unless already loaded"""
+        if not self.users:
+            _prefetch_pool.submit(self.get_users)
+
     def get_groups(self):
-        """Get all groups the user belongs to, sorted by number of participants (from one to many)"""
+        """Get all groups the user belongs to, sorted by number of participants (from one to many); cached briefly"""
+        key = self._cache_key()[0]
+        cached = _groups_cache.get(key)
+        if cached is not None:
+            return cached
         groups = self.client.getGroups()
         # Sort groups by number of members (from one to many)
         sorted_groups = sorted(groups, key=lambda g: len(g.getMembers()))
-        return [{'id': g.getId(), 'name': g.getName(), 'members_count': len(g.getMembers()), 'object': g} for g in sorted_groups]
+        result = [{'id': g.getId(), 'name': g.getName(), 'members_count': len(g.getMembers()), 'object': g} for g in sorted_groups]
+        _groups_cache.set(key, result)
+        return result
 
     def get_expenses(self, **kwargs):
         """Get the most recent expenses for the current group; all kwargs are passed to the library call"""
@@ -116,103 +427,123 @@ class SplitwiseService:
         - same day, total amount within +-15%
         - +- 2 days from the same merchant or category, total amount within +-5%
         """
+        target_amount = _safe_float(receipt_info.total, 0.0)
+        if not target_amount > 0:
+            # Neither criterion can match a non-positive total
+            return []
+
         since = receipt_info.date - relativedelta(days=2)
         until = receipt_info.date + relativedelta(days=2)
         try:
             expenses = self.get_expenses(dated_after=since.isoformat(), dated_before=until.isoformat(), limit=1000)
         except Exception as e:
-            import logging
             logging.error(f"Error fetching expenses for duplicate check: {e}")
             return []
-            
-        duplicates = []
-        
-        target_date = receipt_info.date
-        try:
-            target_amount = float(receipt_info.total)
-        except (ValueError, TypeError):
-            target_amount = 0.0
-            
+
+        self.get_categories()
+        category_names = self._category_name_by_id
+
+        target_day = receipt_info.date.date()
+        # Amount tolerances for the two criteria, computed once for the whole batch
+        same_day_tolerance = 0.15 * target_amount
+        nearby_tolerance = 0.05 * target_amount
         target_merchant = (receipt_info.merchant or "").lower()
         target_category = (receipt_info.category or "").lower()
 
+        # Filter on the raw expense fields; only matches are converted to ReceiptInfo
+        duplicates = []
         for e in expenses:
             if e.getDeletedAt():
                 continue
-            
-            # Use unified converter to get ReceiptInfo for comparison
-            e_ri = ReceiptInfo.from_expense(e, self.get_categories())
-            
-            try:
-                e_amount = float(e_ri.total)
-            except (ValueError, TypeError):
+
+            # NaN for unparsable costs fails this comparison, skipping the expense
+            amount_diff = abs(target_amount - _safe_float(e.getCost()))
+            if not amount_diff <= same_day_tolerance:
+                continue
+
+            e_day = _parse_day(e.getDate())
+            if e_day is None:
                 continue
-                
-            e_description = (e_ri.merchant or "").lower()
-            e_category = (e_ri.category or "").lower()
 
             # Date difference in days
-            date_diff = abs((target_date.date() - e_ri.date.date()).days)
+            date_diff = abs((target_day - e_day).days)
 
-            is_duplicate = False
-            
             # Criteria 1: same day, total amount within +-15%
-            if date_diff == 0:
-                if target_amount > 0 and abs(target_amount - e_amount) <= 0.15 * target_amount:
-                    is_duplicate = True
+            is_duplicate = date_diff == 0
 
             # Criteria 2: +- 2 days from the same merchant or category, total amount within +-5%
-            if not is_duplicate and date_diff <= 2:
-                # Check merchant similarity (one contains another)
-                same_merchant = target_merchant and (target_merchant in e_description or e_description in target_merchant)
-                same_category = target_category and target_category == e_category
-                
-                if (same_merchant or same_category):
-                    if target_amount > 0 and abs(target_amount - e_amount) <= 0.05 * target_amount:
-                        is_duplicate = True
-            
+            if not is_duplicate and date_diff <= 2 and amount_diff <= nearby_tolerance:
+                e_description = (e.getDescription() or "").lower()
+                # Check merchant similarity (one contains another); an empty description matches nothing
+                same_merchant = target_merchant and e_description and (
+                    e_description == target_merchant
+                    or target_merchant in e_description
+                    or e_description in target_merchant
+                )
+                if same_merchant:
+                    is_duplicate = True
+                elif target_category:
+                    category_obj = e.getCategory()
+                    e_category = category_names.get(str(category_obj.getId()), category_obj.getName()) or ""
+                    is_duplicate = target_category == e_category.lower()
+
             if is_duplicate:
-                duplicates.append(e_ri)
-        
+                duplicates.append(ReceiptInfo.from_expense(e, category_names))
+
         return duplicates
 
     def get_representative_examples(self, limit=50):
         """Get representative examples as ReceiptInfo objects"""
+        # Categories are independent of the expenses request, so load them alongside it
+        self._prefetch_categories()
         expenses = self.get_expenses(limit=limit)
-        
-        raw_data = []
+
+        # Waits on the background load if it is still running
+        self.get_categories()
+        category_names = self._category_name_by_id
+
+        # Selection Logic: Prioritize variety, keeping an expense if its merchant, category or split is new.
+        # Expenses are converted as they are considered, so none are converted past the last pick.
+        seen = set()
+        representative = []
         for e in expenses:
             if e.getDeletedAt():
                 continue
-            
-            # Create ReceiptInfo object using the unified converter
-            receipt_info = ReceiptInfo.from_expense(e, self.get_categories())
-            raw_data.append(receipt_info)
 
-        if not raw_data:
-            return []
-
-        # Selection Logic: Prioritize variety
-        seen_merchants = set()
-        seen_categories = set()
-        seen_splits = set()
-        
-        representative = []
-        for ri in raw_data:
-            m, c, s = ri.merchant, ri.category, ri.split_option
-            if m not in seen_merchants or c not in seen_categories or s not in seen_splits:
+            # Create ReceiptInfo object using the unified converter
+            ri = ReceiptInfo.from_expense(e, category_names)
+            keys = {('merchant', ri.merchant), ('category', ri.category), ('split', ri.split_option)}
+            if not keys <= seen:
                 representative.append(ri)
-                seen_merchants.add(m)
-                seen_categories.add(c)
-                seen_splits.add(s)
-            
-            if len(representative) >= 15:
-                break
-                
+                seen |= keys
+                if len(representative) >= 15:
+                    break
+
         return representative
 
+    def get_representative_examples_json(self):
+        """Get representative examples serialized for the LLM prompt, cached; empty string if there are none"""
+        if self._examples_json is not None:
+            return self._examples_json
+
+        key = self._cache_key()
+        cached = _examples_cache.get(key)
+        if cached is not None:
+            self._examples_json = cached
+            return self._examples_json
+
+        examples = self.get_representative_examples()
+        self._examples_json = orjson.dumps([ex.to_dict() for ex in examples], option=orjson.OPT_INDENT_2).decode() if examples else ""
+        _examples_cache.set(key, self._examples_json)
+        return self._examples_json
+
     def create_expense(self, receipt_info: ReceiptInfo, filepath=None):
         """Create an expense in Splitwise"""
+        # Warm the group users and (if needed) categories in parallel; the lookups below wait on them
+        self._prefetch_users()
+        if receipt_info.category:
+            self._prefetch_categories()
+
         # Create expense object
         expense = Expense()
         expense.setCost(receipt_info.total)
@@ -276,8 +607,8 @@ class SplitwiseService:
     def _apply_auto_split(self, expense: Expense, receipt_info: ReceiptInfo):
         """Calculate and set shares based on payer_id and simplified share info."""
         total = float(receipt_info.total)
-        payer_id = receipt_info.payer_id if receipt_info.payer_id is not None else self.get_current_user_id()
         current_user_id = self.get_current_user_id()
+        payer_id = receipt_info.payer_id if receipt_info.payer_id is not None else current_user_id
         
         group_users = self.get_users()
         num_users = len(group_users)
@@ -290,15 +621,10 @@ class SplitwiseService:
         
         # Adjust my_owed based on share_type/value
         my_owed = equal_owed
-        if receipt_info.share_type == 'amount' and receipt_info.share_value:
-            try:
-                my_owed = float(receipt_info.share_value)
-            except (ValueError, TypeError):
-                pass
-        elif receipt_info.share_type == 'percentage' and receipt_info.share_value:
+        owed_share_handler = _OWED_SHARE_HANDLERS.get(receipt_info.share_type)
+        if owed_share_handler and receipt_info.share_value:
             try:
-                percentage = float(receipt_info.share_value)
-                my_owed = (percentage / 100.0) * total
+                my_owed = owed_share_handler(total, receipt_info.share_value)
             except (ValueError, TypeError):
                 pass
         
@@ -309,19 +635,21 @@ class SplitwiseService:
         else:
             other_owed = 0
 
+        # Share strings are the same for every user in a role, so format them once
+        payer_paid_share = str(total)
+        my_owed_share = f"{my_owed:.2f}"
+        other_owed_share = f"{other_owed:.2f}"
+
         for u in group_users:
             eu = ExpenseUser()
             uid = u['id']
             eu.setId(uid)
             
             # Paid share: payer pays all
-            eu.setPaidShare(str(total) if uid == payer_id else "0.0")
+            eu.setPaidShare(payer_paid_share if uid == payer_id else "0.0")
             
             # Owed share: me vs others
-            if uid == current_user_id:
-                eu.setOwedShare(f"{my_owed:.2f}")
-            else:
-                eu.setOwedShare(f"{other_owed:.2f}")
+            eu.setOwedShare(my_owed_share if uid == current_user_id else other_owed_share)
             
             expense.addUser(eu)
 
@@ -332,17 +660,19 @@ class SplitwiseService:
         if not self.access_token:
             raise Exception("Not authenticated with Splitwise")
 
-        headers = {
-            "Authorization": f"Bearer {self.access_token['access_token']}",
-            "Accept": "application/json"
-        }
-
         with open(receipt_path, 'rb') as receipt_file:
-            files = {
-                "receipt": receipt_file
+            # Stream the multipart body from the file instead of building it in memory
+            content_type = mimetypes.guess_type(receipt_path)[0] or 'application/octet-stream'
+            encoder = MultipartEncoder(fields={
+                "receipt": (os.path.basename(receipt_path), receipt_file, content_type)
+            })
+            headers = {
+                "Authorization": f"Bearer {self.access_token['access_token']}",
+                "Accept": "application/json",
+                "Content-Type": encoder.content_type
             }
 
-            response = requests.post(url, headers=headers, files=files)
+            response = _http_session.post(url, headers=headers, data=encoder, timeout=_HTTP_TIMEOUT)
 
             if response.status_code != 200:
                 raise Exception(f"Failed to attach receipt: {response.text}")
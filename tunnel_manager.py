@@ -1,3 +1,5 @@
+import os
+import selectors
 import subprocess
 import time
 import re
@@ -7,6 +9,12 @@ from threading import Thread
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for cloudflared to report the public URL before giving up
+TUNNEL_START_TIMEOUT = 30
+
+# Public URL in cloudflared output (format: https://something.trycloudflare.com), matched on raw bytes
+_TUNNEL_URL_RE = re.compile(rb'https://[a-zA-Z0-9-]+\.trycloudflare\.com')
+
 
 class CloudflareTunnel:
     def __init__(self, port=5001):
@@ -14,7 +22,7 @@ class CloudflareTunnel:
         self.process = None
         self.public_url = None
 
-    def start(self):
+    def start(self, timeout=TUNNEL_START_TIMEOUT):
         """Start cloudflared tunnel and extract the public URL"""
         logger.info(f"Starting cloudflared tunnel for port {self.port}...")
 
@@ -22,20 +30,45 @@ class CloudflareTunnel:
         self.process = subprocess.Popen(
             ['cloudflared', 'tunnel', '--url', f'http://localhost:{self.port}'],
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
+            stderr=subprocess.STDOUT
         )
 
-        # Read output to find the public URL
-        for line in self.process.stdout:
-            logger.debug(f"cloudflared: {line.strip()}")
-            # Look for the URL in output (format: https://something.trycloudflare.com)
-            match = re.search(r'https://[a-zA-Z0-9-]+\.trycloudflare\.com', line)
-            if match:
-                self.public_url = match.group(0)
-                logger.info(f"Tunnel established: {self.public_url}")
-                return self.public_url
+        # Read output without blocking, so a cloudflared that never prints the URL cannot hang startup
+        stdout_fd = self.process.stdout.fileno()
+        os.set_blocking(stdout_fd, False)
+        deadline = time.monotonic() + timeout
+        buffer = b''
+        with selectors.DefaultSelector() as selector:
+            selector.register(stdout_fd, selectors.EVENT_READ)
+            eof = False
+            while not eof:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.process.kill()
+                    self.process.wait()
+                    raise TimeoutError(f"cloudflared did not report a public URL within {timeout} seconds")
+                if not selector.select(timeout=remaining):
+                    continue
+                try:
+                    chunk = os.read(stdout_fd, 4096)
+                except BlockingIOError:
+                    continue
+                if chunk:
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b'\n')
+                else:
+                    # cloudflared exited; scan whatever is left
+                    eof = True
+                    lines = [buffer]
+
+                for line in lines:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"cloudflared: {line.decode(errors='replace').strip()}")
+                    match = _TUNNEL_URL_RE.search(line)
+                    if match:
+                        self.public_url = match.group(0).decode('ascii')
+                        logger.info(f"Tunnel established: {self.public_url}")
+                        return self.public_url
 
         raise Exception("Failed to extract public URL from cloudflared")
 
@@ -1,35 +1,176 @@
 import os
 import secrets
+import uuid
 import logging
-import json
 import base64
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, session, url_for, g
-from werkzeug.utils import secure_filename
+import orjson
+from flask import Flask, Request, Response, render_template, request, jsonify, redirect, session, url_for, g
+from flask.json.provider import DefaultJSONProvider
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 import config
-from bot.telegram_bot import TelegramBot
+from bot.telegram_bot import TelegramBot, TELEGRAM_AUTH_STATE_PREFIX
 from core.receipt_processor import receipt_processor
 from core.splitwise_service import SplitwiseService
 from core.receipt_info import ReceiptInfo
 
+# Endpoints whose uploaded files are written straight into the upload folder
+STREAMED_UPLOAD_ENDPOINTS = {'upload_file', 'upload_and_process'}
+
+# Receipt file types the processor can read, by extension; other uploads are rejected
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.png', '.webp', '.heic', '.heif', '.gif', '.bmp', '.tif', '.tiff', '.pdf'
+})
+
+def upload_extension(filename):
+    """Lowercased extension of an uploaded file name, or None if it is not an allowed receipt type"""
+    ext = os.path.splitext(filename)[1].lower()
+    return ext if ext in ALLOWED_UPLOAD_EXTENSIONS else None
+
+def unique_upload_path(filename):
+    """Path in the upload folder for an uploaded file, under a unique name to avoid collisions.
+    Only the extension of the client's file name is kept, so the name needs no sanitizing."""
+    return os.path.join(UPLOAD_FOLDER, uuid.uuid4().hex + upload_extension(filename))
+
+class UploadRequest(Request):
+    """Request that streams receipt uploads into their final file while the form is parsed,
+    instead of spooling them to a temporary file and copying that afterwards.
+    Streamed files that the view does not claim are deleted when the request is closed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Path -> open file of each upload streamed into the upload folder and not yet claimed
+        self._streamed_uploads = {}
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and self.endpoint in STREAMED_UPLOAD_ENDPOINTS and upload_extension(filename):
+            stream = open(unique_upload_path(filename), 'w+b')
+            self._streamed_uploads[stream.name] = stream
+            return stream
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def claim_streamed_upload(self, path):
+        """Keep a streamed upload file after the request instead of deleting it"""
+        self._streamed_uploads.pop(path, None)
+
+    def close(self):
+        super().close()
+        # Unclaimed files: extra or misnamed form fields, rejected requests and bodies cut off by the client
+        streamed_uploads, self._streamed_uploads = self._streamed_uploads, {}
+        for path, stream in streamed_uploads.items():
+            stream.close()
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove unused upload {path}: {e}")
+
+# Paths that never read or write the session, so the signed cookie is not verified for them
+SESSIONLESS_PATHS = {'/correct', '/telegram_logout'}
+SESSIONLESS_PATH_PREFIXES = ('/static/',)
+
+class SessionlessPathsSessionInterface(SecureCookieSessionInterface):
+    """Cookie session that hands out a null session for paths that do not use it"""
+
+    def open_session(self, app, request):
+        if request.path in SESSIONLESS_PATHS or request.path.startswith(SESSIONLESS_PATH_PREFIXES):
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for jsonify and request.json; types orjson does not know
+    fall back to Flask's default conversion"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__, template_folder='../templates')
+app.request_class = UploadRequest
+app.session_interface = SessionlessPathsSessionInterface()
+app.json = OrjsonProvider(app)
 app.config['UPLOAD_FOLDER'] = config.UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
 app.config['TEMPLATES_AUTO_RELOAD'] = config.TEMPLATES_AUTO_RELOAD
-app.secret_key = secrets.token_hex(16)  # Required for session management
+app.secret_key = config.SECRET_KEY or secrets.token_hex(16)  # Required for session management
+
+if not app.config['TEMPLATES_AUTO_RELOAD']:
+    # Templates cannot change while running, so compile them at startup rather than on first render
+    for template_name in ('index.html', 'select_group.html', 'telegram_success.html', 'telegram_correction.html'):
+        app.jinja_env.get_template(template_name)
+
+UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Clients refer to uploads by a signed, expiring ID instead of a server path
+upload_id_serializer = URLSafeTimedSerializer(app.secret_key, salt='upload-id')
+UPLOAD_ID_MAX_AGE = 60 * 60  # seconds
+
+# Extraction started by /upload as soon as the file is saved, collected by /process_receipt:
+# upload file name -> (start time, access token, future)
+ocr_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='receipt-ocr')
+ocr_futures = {}
+ocr_futures_lock = threading.Lock()
+OCR_RESULT_TIMEOUT = 120  # seconds
+
+# Fixed error replies as (body, status), serialized once at import. Each request still gets
+# its own Response from error_response, because responses are modified on the way out.
+NOT_AUTHENTICATED = (orjson.dumps({'error': 'Not authenticated with Splitwise'}), 401)
+NO_FILE_PART = (orjson.dumps({'error': 'No file part'}), 400)
+NO_SELECTED_FILE = (orjson.dumps({'error': 'No selected file'}), 400)
+UNSUPPORTED_FILE_TYPE = (orjson.dumps({'error': 'Unsupported file type'}), 400)
+INVALID_UPLOAD_ID = (orjson.dumps({'error': 'Missing, invalid or expired upload_id'}), 400)
+INVALID_JSON_BODY = (orjson.dumps({'error': 'Invalid JSON body'}), 400)
+MISSING_RECEIPT_INFO = (orjson.dumps({'error': 'Missing receipt information or upload_id'}), 400)
+
+def error_response(error):
+    """JSON response for one of the prebuilt (body, status) errors"""
+    body, status = error
+    return Response(body, status=status, mimetype='application/json')
 
 def is_authenticated():
     """Check if the user is authenticated with Splitwise"""
-    return 'oauth2_access_token' in session
+    # Token read from the session once per request by setup_splitwise_service
+    return g.get('access_token') is not None
+
+# Endpoints that never call Splitwise, so no service is built for them
+SERVICELESS_ENDPOINTS = frozenset({'index', 'correct', 'check_auth', 'telegram_logout', 'logout', 'static'})
 
 @app.before_request
 def setup_splitwise_service():
     """Set up the Splitwise service for the current request"""
-    access_token = session.get('oauth2_access_token')
-    group_id = session.get('splitwise_group_id')
+    g.access_token = session.get('oauth2_access_token')
+    g.group_id = session.get('splitwise_group_id')
+    if request.endpoint in SERVICELESS_ENDPOINTS:
+        # Pages that only look at the session do not need a Splitwise client
+        return
     # Create a new instance for this request to ensure thread-safety and user isolation
-    g.splitwise_service = SplitwiseService(access_token=access_token, group_id=group_id)
+    g.splitwise_service = SplitwiseService(access_token=g.access_token, group_id=g.group_id)
+
+# Endpoints that need a Splitwise login: pages redirect to it, JSON endpoints answer 401.
+# /categories is left out: the Telegram correction page loads it without a session.
+LOGIN_REDIRECT_ENDPOINTS = frozenset({'select_group', 'set_group'})
+NOT_AUTHENTICATED_ENDPOINTS = frozenset({
+    'get_group_members', 'upload_file', 'upload_and_process', 'process_receipt', 'create_expense'
+})
+
+@app.before_request
+def require_authentication():
+    """Reject requests to protected endpoints before the view runs"""
+    if is_authenticated():
+        return None
+    if request.endpoint in NOT_AUTHENTICATED_ENDPOINTS:
+        return error_response(NOT_AUTHENTICATED)
+    if request.endpoint in LOGIN_REDIRECT_ENDPOINTS:
+        return redirect(url_for('authorize'))
+    return None
 
 @app.route('/authorize')
 def authorize():
@@ -54,25 +195,16 @@ def callback():
     if not code:
         return jsonify({'error': 'Missing code parameter'}), 400
 
-    # Try to parse the state as JSON to extract user_id for Telegram flow
-    user_id = None
-    is_telegram_flow = False
+    is_telegram_flow = bool(state) and state.startswith(TELEGRAM_AUTH_STATE_PREFIX)
     redirect_uri = f"{config.WEB_APP_URL}/callback"
 
-    try:
-        # First check if this is a Telegram flow by trying to parse the state as base64-encoded JSON
-        # Decode the base64 string, then parse the JSON
-        decoded_state = base64.b64decode(state).decode('utf-8')
-        state_data = json.loads(decoded_state)
-        if isinstance(state_data, dict) and 'user_id' in state_data:
-            user_id = state_data['user_id']
-            is_telegram_flow = True
-    except (json.JSONDecodeError, TypeError, base64.binascii.Error):
-        # If state is not valid base64-encoded JSON or doesn't contain user_id, assume it's a web app flow
-        pass
-
     if is_telegram_flow:
-        # Telegram bot flow
+        # Telegram bot flow: the state carries the user_id as prefixed base64-encoded JSON
+        try:
+            state_data = orjson.loads(base64.urlsafe_b64decode(state[len(TELEGRAM_AUTH_STATE_PREFIX):]))
+        except (orjson.JSONDecodeError, ValueError):
+            return jsonify({'error': 'Invalid state parameter'}), 400
+        user_id = state_data.get('user_id') if isinstance(state_data, dict) else None
         if not user_id:
             return jsonify({'error': 'Missing user_id in state parameter'}), 400
 
@@ -116,10 +248,6 @@ def callback():
 @app.route('/select_group')
 def select_group():
     """Show the group selection page"""
-    # Check if the user is authenticated
-    if not is_authenticated():
-        return redirect(url_for('authorize'))
-
     # Get the list of groups
     groups = g.splitwise_service.get_groups()
 
@@ -128,10 +256,6 @@ def select_group():
 @app.route('/set_group', methods=['POST'])
 def set_group():
     """Set the selected group"""
-    # Check if the user is authenticated
-    if not is_authenticated():
-        return redirect(url_for('authorize'))
-
     # Get the selected group ID from the form
     group_id = request.form.get('group_id')
     if not group_id:
@@ -155,16 +279,11 @@ def check_auth():
     if not user_id:
         return jsonify({'error': 'Missing user_id parameter'}), 400
 
-    # Check if there's a temporary session for this user
-    session_key = f"telegram_auth_{user_id}"
-    if session_key in session:
-        # Get the access token from the temporary session
-        auth_data = session[session_key]
+    # Take the temporary session for this user, if any, removing it in the same lookup
+    auth_data = session.pop(f"telegram_auth_{user_id}", None)
+    if auth_data is not None:
         access_token = auth_data.get('access_token')
 
-        # Remove the temporary session
-        session.pop(session_key, None)
-
         return jsonify({
             'authenticated': True,
             'access_token': access_token
@@ -192,9 +311,20 @@ def logout():
 @app.route('/categories')
 def get_categories():
     """Return the list of categories as JSON"""
-    categories = g.splitwise_service.get_categories()
-    result = [dict(id=c['id'], name=c['name']) for c in sorted(categories, key=lambda c: c['name'].lower())]
-    return jsonify(result)
+    # Sorted and serialized once per access token by the service
+    try:
+        body = g.splitwise_service.get_categories_json()
+    except Exception:
+        if is_authenticated():
+            raise
+        # Without a login only categories cached or saved by an earlier run can be served
+        return error_response(NOT_AUTHENTICATED)
+    response = Response(body, mimetype='application/json')
+    # Let the browser revalidate its copy and get an empty 304 while the list is unchanged
+    response.set_etag(hashlib.blake2b(body, digest_size=8).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
 @app.route('/group_members')
 def get_group_members():
@@ -212,11 +342,10 @@ def index():
     try:
         # Check if the user is authenticated
         authenticated = is_authenticated()
-        if authenticated:
-            # Check if a group has been selected
-            if 'splitwise_group_id' not in session and not request.path.startswith('/select_group'):
-                # If no group has been selected, redirect to the group selection page
-                return redirect(url_for('select_group'))
+        # Check if a group has been selected
+        if authenticated and g.group_id is None:
+            # If no group has been selected, redirect to the group selection page
+            return redirect(url_for('select_group'))
 
         return render_template('index.html', authenticated=authenticated)
     except Exception as e:
@@ -232,50 +361,140 @@ def correct():
     except Exception as e:
         return f"Error rendering correction template: {str(e)}", 500
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    # Check if the user is authenticated
-    if not is_authenticated():
-        return jsonify({'error': 'Not authenticated with Splitwise'}), 401
-
+def get_uploaded_file():
+    """Return the uploaded receipt file and None, or None and an error response"""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        return None, error_response(NO_FILE_PART)
 
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-
-    if file:
-        # Generate a unique filename to avoid collisions
-        unique_prefix = secrets.token_urlsafe(10)
-        filename = secure_filename(file.filename)
-        unique_filename = f"{unique_prefix}-{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
-
-        # Return initial status to show progress spinner
-        response = jsonify({
-            'status': 'processing',
-            'message': 'Parsing receipt details...',
-            'filepath': filepath  # Return the actual filepath for subsequent requests
-        })
-        response.status_code = 202  # Accepted
-        return response
+        return None, error_response(NO_SELECTED_FILE)
+
+    if not upload_extension(file.filename):
+        return None, error_response(UNSUPPORTED_FILE_TYPE)
+
+    return file, None
+
+def save_uploaded_file(file):
+    """Save an uploaded file under a unique name in the upload folder and return its path"""
+    stream_path = getattr(file.stream, 'name', None)
+    if isinstance(stream_path, str) and os.path.dirname(stream_path) == UPLOAD_FOLDER:
+        # Already streamed into the upload folder by UploadRequest; just make sure it is on disk
+        file.stream.flush()
+        request.claim_streamed_upload(stream_path)
+        return stream_path
+
+    filepath = unique_upload_path(file.filename)
+    # Copy in larger chunks than the 16 KiB default to cut read/write calls for phone photos
+    file.save(filepath, buffer_size=UPLOAD_COPY_BUFFER_SIZE)
+    return filepath
+
+def make_upload_id(filepath):
+    """Signed opaque reference to an uploaded file, for the client to send back in later requests"""
+    return upload_id_serializer.dumps(os.path.basename(filepath))
+
+def resolve_upload_id(upload_id):
+    """Path of the upload an ID was issued for, or None if the ID is missing, forged or expired"""
+    if not isinstance(upload_id, str):
+        return None
+    try:
+        return os.path.join(UPLOAD_FOLDER, upload_id_serializer.loads(upload_id, max_age=UPLOAD_ID_MAX_AGE))
+    except BadSignature:
+        return None
+
+def start_receipt_extraction(filepath):
+    """Start extracting receipt info for an upload in the background"""
+    future = ocr_pool.submit(receipt_processor.extract_receipt_info, filepath, sw=g.splitwise_service)
+    now = time.monotonic()
+    with ocr_futures_lock:
+        # Forget extractions whose upload ID has expired without being collected; queued ones never start
+        for name in [n for n, (started, _, _) in ocr_futures.items() if now - started > UPLOAD_ID_MAX_AGE]:
+            ocr_futures.pop(name)[2].cancel()
+        ocr_futures[os.path.basename(filepath)] = (now, g.access_token, future)
+
+def collect_receipt_extraction(filepath):
+    """Receipt info for an upload: the background extraction's result if this user started one, else extracted now"""
+    name = os.path.basename(filepath)
+    with ocr_futures_lock:
+        entry = ocr_futures.get(name)
+        if entry is not None and entry[1] == g.access_token:
+            del ocr_futures[name]
+        else:
+            entry = None
+    if entry is not None:
+        try:
+            return entry[2].result(timeout=OCR_RESULT_TIMEOUT)
+        except TimeoutError:
+            # Still queued or running: keep it, so a retry waits for it instead of paying for a second extraction
+            with ocr_futures_lock:
+                ocr_futures.setdefault(name, entry)
+            raise
+    return receipt_processor.extract_receipt_info(filepath, sw=g.splitwise_service)
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Save the uploaded receipt and start extracting its details for a later /process_receipt.
+    Legacy two-step path: the web page uses /upload_and_process instead.
+    """
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    filepath = save_uploaded_file(file)
+    # Begin extraction now, so it is underway by the time the client asks for the result
+    start_receipt_extraction(filepath)
+
+    # Return initial status to show progress spinner
+    response = jsonify({
+        'status': 'processing',
+        'message': 'Parsing receipt details...',
+        'upload_id': make_upload_id(filepath)  # Identifies the file in subsequent requests
+    })
+    response.status_code = 202  # Accepted
+    return response
+
+@app.route('/upload_and_process', methods=['POST'])
+def upload_and_process():
+    """Save the uploaded receipt and extract its details in a single round trip.
+    Expense creation stays a separate call because the user reviews the details first.
+    """
+    file, error = get_uploaded_file()
+    if error:
+        return error
+
+    filepath = save_uploaded_file(file)
+
+    try:
+        # Extract information from the image
+        receipt_info = receipt_processor.extract_receipt_info(filepath, sw=g.splitwise_service)
+        logging.info(f"Receipt info: {receipt_info}")
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify({
+        'status': 'processing',
+        'message': 'Sending receipt to Splitwise...',
+        'upload_id': make_upload_id(filepath),
+        'receipt_info': receipt_info.to_dict()
+    })
+    response.status_code = 202  # Accepted
+    return response
 
 @app.route('/process_receipt', methods=['POST'])
 def process_receipt():
-    # Check if the user is authenticated
-    if not is_authenticated():
-        return jsonify({'error': 'Not authenticated with Splitwise'}), 401
-
-    # Get the filepath from the request
-    filepath = request.json.get('filepath')
+    # Resolve the uploaded file from the request
+    filepath = resolve_upload_id(request.json.get('upload_id'))
     if not filepath:
-        return jsonify({'error': 'No filepath provided'}), 400
+        return error_response(INVALID_UPLOAD_ID)
 
-    # Extract information from the image
-    receipt_info = receipt_processor.extract_receipt_info(filepath, sw=g.splitwise_service)
-    logging.info(f"Receipt info: {receipt_info}")
+    try:
+        # Extract information from the image, or wait for the extraction /upload started
+        receipt_info = collect_receipt_extraction(filepath)
+        logging.info(f"Receipt info: {receipt_info}")
+    except TimeoutError:
+        return jsonify({'error': 'Receipt is still being processed, please try again shortly'}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
     if receipt_info:
         try:
@@ -295,18 +514,17 @@ def process_receipt():
 
 @app.route('/create_expense', methods=['POST'])
 def create_expense():
-    # Check if the user is authenticated
-    if not is_authenticated():
-        return jsonify({'error': 'Not authenticated with Splitwise'}), 401
-
-    # Get the receipt info and filepath from the request
-    data = request.json
+    # Get the receipt info and upload from the request, decoding the body once with orjson
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return error_response(INVALID_JSON_BODY)
     receipt_info_data = data.get('receipt_info')
-    filepath = data.get('filepath')
+    filepath = resolve_upload_id(data.get('upload_id'))
     force = data.get('force', False)
 
     if not receipt_info_data or not filepath:
-        return jsonify({'error': 'Missing receipt information or filepath'}), 400
+        return error_response(MISSING_RECEIPT_INFO)
 
     try:
         # Convert incoming dict to ReceiptInfo